@@ -1,5 +1,3 @@
-import sys
-import inspect
 from datetime import datetime
 
 from peewee import Model
@@ -8,15 +6,20 @@ import pysky.models
 
 
 def get_model_classes():
-    class_members = inspect.getmembers(sys.modules["pysky.models"], inspect.isclass)
-    return [(n, cls) for n, cls in class_members if cls.__base__ == pysky.models.BaseModel]
+    return [
+        (cls.__name__, cls)
+        for cls in pysky.models.BaseModel.__subclasses__()
+        if cls.__module__ == pysky.models.__name__
+    ]
 
 
 def create_non_existing_tables(db):
 
+    # one query for the table list rather than a table_exists() query per model
+    existing_tables = set(db.get_tables())
     all_model_classes = get_model_classes()
     missing_table_model_classes = [
-        (n, cls) for n, cls in all_model_classes if not cls.table_exists()
+        (n, cls) for n, cls in all_model_classes if cls._meta.table_name not in existing_tables
     ]
 
     if not missing_table_model_classes:
@@ -1,20 +1,29 @@
-import re
 import json
-import inspect
-from time import time, sleep
+import base64
+import threading
+from time import time, sleep, perf_counter_ns
 from types import SimpleNamespace
+from collections import OrderedDict
 from datetime import datetime, timezone
 
 import peewee
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from pysky.logging import log
+from pysky.mimetype import guess_file_type
 from pysky.session import Session, ENDPOINT_SESSION_REFRESH
 from pysky.models import BaseModel, BskySession, BskyUserProfile, APICallLog, BskyPost
-from pysky.ratelimit import WRITE_OP_POINTS_MAP, check_write_ops_budget
+from pysky.ratelimit import (
+    WRITE_OP_POINTS_MAP,
+    MAX_RATE_LIMIT_WAIT_SECONDS,
+    check_write_ops_budgets,
+    get_rate_limit_reset,
+)
 from pysky.bin.create_tables import create_non_existing_tables
 from pysky.exceptions import APIError, NotAuthenticated, UploadException, MediaException
-from pysky.decorators import process_cursor, ZERO_CURSOR
+from pysky.decorators import process_cursor, cursor_context, ZERO_CURSOR
 from pysky.constants import (
     HOSTNAME_PUBLIC,
     HOSTNAME_ENTRYWAY,
@@ -38,12 +47,38 @@ SERVICE_AUTH_ENDPOINTS = {
     ),
 }
 
+# service auth tokens for these endpoints are reused until shortly before they
+# expire. uploadVideo isn't included because the video service keeps using its
+# token to upload the blob to the PDS after the request has returned.
+REUSABLE_SERVICE_AUTH_ENDPOINTS = frozenset(["xrpc/app.bsky.video.getUploadLimits"])
+SERVICE_AUTH_MIN_REMAINING_SECONDS = 30
+
 ENDPOINT_HOST_MAP = {
     "xrpc/app.bsky.video.uploadVideo": HOSTNAME_VIDEO,
     "xrpc/app.bsky.video.getJobStatus": HOSTNAME_VIDEO,
 }
 
-VALID_COLLECTIONS = [
+# user profiles kept in memory per client, each cached under its did and handle.
+# after the ttl the profile is read from the database again, in case another
+# process or client has updated it.
+PROFILE_CACHE_SIZE = 1024
+PROFILE_CACHE_TTL_SECONDS = 900
+
+# getProfile response fields copied to BskyUserProfile, the associated and
+# viewer fields are saved with an associated_ or viewer_ prefix
+PROFILE_FIELDS = (
+    "handle",
+    "displayName",
+    "followersCount",
+    "followsCount",
+    "postsCount",
+    "description",
+    "createdAt",
+)
+PROFILE_ASSOCIATED_FIELDS = ("lists", "feedgens", "starterPacks", "labeler")
+PROFILE_VIEWER_FIELDS = ("muted", "blockedBy", "blocking")
+
+VALID_COLLECTIONS = frozenset([
     "app.bsky.actor.profile",
     "app.bsky.feed.generator",
     "app.bsky.feed.like",
@@ -51,7 +86,38 @@ VALID_COLLECTIONS = [
     "app.bsky.graph.block",
     "app.bsky.graph.follow",
     "chat.bsky.actor.declaration",
-]
+])
+
+
+def namespace_object_hook(d):
+    return SimpleNamespace(**d)
+
+
+def namespace_json_default(obj):
+    # allow objects from parsed responses to be passed back in as params
+    if isinstance(obj, SimpleNamespace):
+        return vars(obj)
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+def get_jwt_expiration(token):
+    """Return the exp claim of a JWT without verifying it, or None if it can't be read."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))["exp"]
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class GatewayRetry(Retry):
+    """Retry policy for gateway errors. A 503 to a POST isn't retried since the write
+    may already have been accepted, 502/504 are retried for both methods as before."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST" and status_code == 503:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
 
 
 class BskyClient:
@@ -59,6 +125,45 @@ class BskyClient:
     def __init__(self, peewee_db=None, **kwargs):
 
         self.session = Session(**kwargs)
+
+        # most recent cursor received per (endpoint, cursor_key), see process_cursor
+        self._cursor_cache = {}
+
+        # (profile, time cached) already looked up by this client, most recently used last.
+        # the lock is held for every read and write since a client can be shared by threads
+        self._profile_cache = OrderedDict()
+        self._profile_cache_lock = threading.Lock()
+
+        # reset time per hostname whose rate limit was exhausted by the last response
+        self._rate_limit_resets = {}
+
+        # write ops budgets to use instead of WRITE_OPS_BUDGETS, keyed by hours
+        self.override_budgets = {}
+
+        # (token, exp) per (lxm, aud), see REUSABLE_SERVICE_AUTH_ENDPOINTS
+        self._service_auth_cache = {}
+
+        # reuse connections to the handful of bluesky hosts across calls, and retry
+        # gateway errors with backoff. read errors, and 503s to POSTs, aren't retried
+        # since the server may already have processed a write. Retry-After is ignored so that 429s
+        # aren't retried with uncapped sleeps here, see wait_for_rate_limit_reset.
+        # the last response is returned as-is if the retries are exhausted so that
+        # it's handled like any other error.
+        self.http = requests.Session()
+        self.http.headers.update({"User-Agent": "pysky - python bluesky library"})
+        retry = GatewayRetry(
+            total=3,
+            read=0,
+            backoff_factor=1,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
         if peewee_db:
             assert isinstance(
                 peewee_db, peewee.Database
@@ -82,68 +187,98 @@ class BskyClient:
     def pds_service_hostname(self):
         return self.pds_service_endpoint.split("/")[-1] if self.pds_service_endpoint else None
 
+    @staticmethod
+    def rewind_request_body(args):
+        # a file being streamed as the request body has to be re-read from the start on retry
+        if hasattr(args.get("data"), "seek"):
+            args["data"].seek(0)
+
     def call_with_dns_retry(self, method, uri, args):
         try:
-            r = method(uri, **args)
-            if r.status_code in [502,504]:
-                sleep(5)
-                r = method(uri, **args)
-            return r
+            return method(uri, **args)
         except requests.exceptions.ConnectionError as e:
             if "Temporary failure in name resolution" in str(e):
                 log.warning(f"caught temporary dns error: {e}, retrying")
                 sleep(5)
+                self.rewind_request_body(args)
                 r = method(uri, **args)
                 log.warning(f"recovered from temporary dns error: {r.status_code}")
                 return r
 
-    def call_with_session_refresh(self, method, uri, args):
+    def wait_for_rate_limit_reset(self, hostname):
+        reset = self._rate_limit_resets.pop(hostname, None)
+        if reset is None:
+            return
+
+        # the next request would only get a 429, unless the wait is too long to be
+        # worth it, in which case let the request fail as it normally would
+        wait_seconds = reset - time()
+        if 0 < wait_seconds <= MAX_RATE_LIMIT_WAIT_SECONDS:
+            log.warning(f"rate limit exhausted for {hostname}, waiting {wait_seconds:.0f}s for reset")
+            sleep(wait_seconds)
 
-        args["headers"].update({"User-Agent": "pysky - python bluesky library"})
+    def call_with_session_refresh(self, method, uri, args, session_generation):
 
-        time_start = time()
+        time_start = perf_counter_ns()
         r = self.call_with_dns_retry(method, uri, args)
-        time_end = time()
+        time_end = perf_counter_ns()
         session_was_refreshed = False
 
-        session_revoked = Session.is_revoked_token_response(r)
-        session_expired = Session.is_expired_token_response(r)
+        token_error = Session.get_token_error(r)
+        session_revoked = Session.is_revoked_token_error(token_error)
+        session_expired = Session.is_expired_token_error(token_error)
 
         # if the refresh token is expired, don't cause infinite recursion by refreshing it
         if session_expired and ENDPOINT_SESSION_REFRESH in uri:
             raise Exception("Session refresh failed")
 
-        if session_revoked:
-            log.info("session revoked, creating a new one")
-            self.session.create(self)
-        elif session_expired:
-            log.info("session expired, refreshing the existing one")
-            try:
-                self.session.refresh(self)
-            except Exception as e:
-                if "Session refresh failed" in str(e):
-                    self.session.create(self)
+        with self.session.lock:
+            # if another thread replaced the session after this request's token was
+            # copied into its headers, just retry with the new token rather than
+            # replacing it again
+            session_replaced = self.session.generation != session_generation
+
+            if session_revoked and not session_replaced:
+                log.info("session revoked, creating a new one")
+                self.session.create(self)
+            elif session_expired and not session_replaced:
+                log.info("session expired, refreshing the existing one")
+                try:
+                    self.session.refresh(self)
+                except Exception as e:
+                    if "Session refresh failed" in str(e):
+                        self.session.create(self)
 
         if session_revoked or session_expired:
             args["headers"].update(self.auth_header)
-            time_start = time()
+            self.rewind_request_body(args)
+            time_start = perf_counter_ns()
             r = self.call_with_dns_retry(method, uri, args)
-            time_end = time()
+            time_end = perf_counter_ns()
             session_was_refreshed = True
 
-        return r, int((time_end - time_start) * 1000000), session_was_refreshed
+        return r, (time_end - time_start) // 1000, session_was_refreshed
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def post(self, **kwargs):
-        kwargs["method"] = requests.post
+        kwargs["method"] = self.http.post
         return self.call(**kwargs)
 
     def get(self, **kwargs):
-        kwargs["method"] = requests.get
+        kwargs["method"] = self.http.get
         return self.call(**kwargs)
 
     def call(
         self,
-        method=requests.get,
+        method=None,
         hostname=None,
         endpoint=None,
         auth_method=AUTH_METHOD_TOKEN,
@@ -154,6 +289,7 @@ class BskyClient:
         cursor_key=None,
         **kwargs,
     ):
+        method = method or self.http.get
         hostname = hostname or ENDPOINT_HOST_MAP.get(endpoint, HOSTNAME_PUBLIC)
         uri = f"https://{hostname}/{endpoint}"
 
@@ -165,9 +301,11 @@ class BskyClient:
         )
 
         args = {}
-        args["headers"] = headers or {}
+        # copy so the auth and other headers added below don't leak into the caller's dict
+        args["headers"] = dict(headers) if headers else {}
 
         request_requires_auth = hostname != HOSTNAME_PUBLIC
+        session_generation = self.session.generation
 
         # use the real PDS endpoint instead of the entryway, if possible
         if hostname == HOSTNAME_ENTRYWAY:
@@ -183,7 +321,9 @@ class BskyClient:
 
             if auth_method == AUTH_METHOD_TOKEN and not self.auth_header:
                 # prevent request from happening without a valid session
-                self.session.load_or_create(self)
+                with self.session.lock:
+                    if not self.auth_header:
+                        self.session.load_or_create(self)
 
             elif auth_method == AUTH_METHOD_PASSWORD:
                 # allow request to happen in order to establish a valid session
@@ -197,23 +337,20 @@ class BskyClient:
 
             # add auth header if appropriate
             if auth_method == AUTH_METHOD_TOKEN:
-                args["headers"].update(self.auth_header)
+                # read together so the generation matches the token that's sent, even
+                # if the session is replaced while this call waits below
+                with self.session.lock:
+                    session_generation = self.session.generation
+                    args["headers"].update(self.auth_header)
                 apilog.request_did = self.did
 
         write_op_points_cost = WRITE_OP_POINTS_MAP.get(endpoint, 0)
         apilog.write_op_points_consumed = write_op_points_cost
         if write_op_points_cost > 0:
-            check_write_ops_budget(
+            check_write_ops_budgets(
                 self.did,
-                hours=1,
                 points_to_use=write_op_points_cost,
-                override_budget=getattr(self, "override_budgets", {}).get(1),
-            )
-            check_write_ops_budget(
-                self.did,
-                hours=24,
-                points_to_use=write_op_points_cost,
-                override_budget=getattr(self, "override_budgets", {}).get(24),
+                override_budgets=self.override_budgets,
             )
 
         params = params or {}
@@ -235,30 +372,45 @@ class BskyClient:
         elif auth_method == AUTH_METHOD_PASSWORD:
             args["json"] = self.session.to_dict()
 
-        if params and method == requests.get:
+        params_json = None
+        if params and method.__name__ == "get":
             args["params"] = params
-        elif data and method == requests.post:
+        elif data and method.__name__ == "post":
             args["data"] = data
             if params:
                 args["params"] = params
-        elif params and method == requests.post:
+        elif params and method.__name__ == "post":
             if "json" in args:
                 args["json"].update(params)
             else:
-                args["json"] = params
+                # serialize the body here so that it can be reused for the log below
+                params_json = json.dumps(params, default=namespace_json_default)
+                args["data"] = params_json.encode("utf-8")
+                args["headers"].setdefault("Content-Type", "application/json")
+
+        if params:
+            params_json = params_json or json.dumps(params, default=namespace_json_default)
+        apilog.params = params_json[:1024*16] if params else "{}"
 
-        apilog.params = json.dumps(params)[:1024*16]
+        self.wait_for_rate_limit_reset(hostname)
 
         try:
             r, duration_microseconds, session_was_refreshed = self.call_with_session_refresh(
-                method, uri, args
+                method, uri, args, session_generation
             )
+
+            rate_limit_reset = get_rate_limit_reset(r.headers)
+            if rate_limit_reset:
+                self._rate_limit_resets[hostname] = rate_limit_reset
+
             try:
-                response_object = json.loads(r.text, object_hook=lambda d: SimpleNamespace(**d))
+                # parse the raw bytes, json detects the utf encoding itself and this
+                # skips requests' decode (and possible charset sniffing) of r.text
+                response_object = json.loads(r.content, object_hook=namespace_object_hook)
                 response_object.http = SimpleNamespace(
                     headers=r.headers, status_code=r.status_code, elapsed=r.elapsed, url=r.url
                 )
-            except json.JSONDecodeError:
+            except (json.JSONDecodeError, UnicodeDecodeError):
                 response_object = SimpleNamespace()
 
             apilog.session_was_refreshed = session_was_refreshed
@@ -266,13 +418,15 @@ class BskyClient:
             apilog.http_status_code = r.status_code
 
             if r.status_code != 200:
-                apilog.exception_response = r.text[:1024*16]
+                # decode only what's kept, r.text would decode the whole body and
+                # guess its encoding first if the response doesn't declare a charset
+                apilog.exception_response = r.content[:1024*16].decode("utf-8", "replace")
                 apilog.exception_class = getattr(response_object, "error", None)
                 apilog.exception_text = getattr(response_object, "message", None)
 
             apilog.response_keys = ",".join(sorted(response_object.__dict__.keys()))
 
-            if "cursor_mgmt" in [f.function for f in inspect.stack()]:
+            if getattr(cursor_context, "active", False):
                 apilog.cursor_received = getattr(response_object, "cursor", None)
                 apilog.cursor_key = cursor_key
 
@@ -286,6 +440,9 @@ class BskyClient:
 
         apilog.save()
 
+        if apilog.cursor_received:
+            self._cursor_cache[(endpoint, cursor_key)] = apilog.cursor_received
+
         err_prefix = None
         if apilog.exception_class:
             err_prefix = (
@@ -320,7 +477,14 @@ class BskyClient:
         response_object.apilog = apilog
         return response_object
 
-    def upload_blob(self, data, mimetype, hostname=HOSTNAME_ENTRYWAY):
+    def upload_blob(self, data=None, mimetype=None, hostname=HOSTNAME_ENTRYWAY, filename=None):
+        if filename:
+            # stream the file from disk rather than reading it all into memory first
+            mimetype = mimetype or guess_file_type(filename)[0]
+            with open(filename, "rb") as f:
+                return self.upload_blob(f, mimetype, hostname)
+
+        assert mimetype, "called upload_blob with data but no mimetype"
         return self.post(
             data=data,
             endpoint="xrpc/com.atproto.repo.uploadBlob",
@@ -368,7 +532,7 @@ class BskyClient:
             except MediaException:
                 raise
             except Exception as e:
-                raise UploadException(f"{e.__class__.__name__} - {e}")
+                raise UploadException(f"{e.__class__.__name__} - {e}") from e
 
             post_dict = post.as_dict()
 
@@ -466,22 +630,31 @@ class BskyClient:
 
     @staticmethod
     def get_user_profile_static(actor):
-        bsky = BskyClient()
         ignore_error_tokens = ["AccountDeactivated","AccountTakedown","InvalidRequest"]
-        try:
-            bsky.get_user_profile(actor)
-        except APIError as e:
-            log.info(f"e.message: {e.message}")
-            if not any(t in e.message for t in ignore_error_tokens):
-                raise
+        with BskyClient() as bsky:
+            try:
+                bsky.get_user_profile(actor)
+            except APIError as e:
+                log.info(f"e.message: {e.message}")
+                if not any(t in e.message for t in ignore_error_tokens):
+                    raise
 
     def get_user_profile(self, actor, force_remote_call=False):
         """Either a user handle or DID can be passed to this method. Handle
         should not include the @ symbol, but it will be stripped if passed."""
-        actor = re.sub(r"^@", "", actor)
+        actor = actor[1:] if actor.startswith("@") else actor
+
+        if not force_remote_call:
+            with self._profile_cache_lock:
+                user, cached_at = self._profile_cache.get(actor, (None, 0))
+                if user and time() - cached_at < PROFILE_CACHE_TTL_SECONDS:
+                    self._profile_cache.move_to_end(actor)
+                    return user
+                self._profile_cache.pop(actor, None)
+
         try:
             assert force_remote_call == False
-            return BskyUserProfile.get_by_actor(actor)
+            return self.cache_user_profile(BskyUserProfile.get_by_actor(actor))
         except (BskyUserProfile.DoesNotExist, AssertionError):
             endpoint = "xrpc/app.bsky.actor.getProfile"
             try:
@@ -502,25 +675,14 @@ class BskyClient:
             if not user:
                 user = BskyUserProfile(did=response.did)
 
-            fields = [
-                "handle",
-                "displayName",
-                "followersCount",
-                "followsCount",
-                "postsCount",
-                "description",
-                "createdAt",
-            ]
-            for f in fields:
+            for f in PROFILE_FIELDS:
                 setattr(user, f, getattr(response, f, None))
 
-            associated_fields = "lists,feedgens,starterPacks,labeler".split(",")
-            for f in associated_fields:
+            for f in PROFILE_ASSOCIATED_FIELDS:
                 setattr(user, f"associated_{f}", getattr(response.associated, f, None))
 
-            viewer_fields = "muted,blockedBy,blocking".split(",")
-            for f in viewer_fields:
-                if hasattr(response, "viewer"):
+            if hasattr(response, "viewer"):
+                for f in PROFILE_VIEWER_FIELDS:
                     setattr(user, f"viewer_{f}", getattr(response.viewer, f, None))
 
             user.labels = ",".join(l.val for l in getattr(response, "labels", []))
@@ -530,16 +692,57 @@ class BskyClient:
                 user.createdAt = datetime(1800, 1, 1).astimezone(timezone.utc).strftime("%Y-%m-%d 00:00:00")
 
             user.save()
+            return self.cache_user_profile(user)
+
+    def cache_user_profile(self, user):
+        if not user:
             return user
 
+        with self._profile_cache_lock:
+            # drop the handle of an earlier copy of this profile if the account no
+            # longer uses it, since it could belong to someone else now
+            previous, _ = self._profile_cache.get(user.did, (None, 0))
+            if previous and previous.handle and previous.handle != user.handle:
+                cached, _ = self._profile_cache.get(previous.handle, (None, 0))
+                if cached and cached.did == user.did:
+                    del self._profile_cache[previous.handle]
+
+            # cache under both the did and the handle so that a later lookup by
+            # either one is a hit, regardless of which was used this time
+            cached_at = time()
+            for key in (user.did, user.handle):
+                if key:
+                    self._profile_cache[key] = (user, cached_at)
+                    self._profile_cache.move_to_end(key)
+            while len(self._profile_cache) > PROFILE_CACHE_SIZE * 2:
+                self._profile_cache.popitem(last=False)
+
+        return user
+
+    def flush_profile_cache(self):
+        with self._profile_cache_lock:
+            self._profile_cache.clear()
+
     def get_service_auth(self, service_endpoint, lxm=None, aud=None, exp=None):
 
         lxm, aud_func = SERVICE_AUTH_ENDPOINTS[service_endpoint]
         aud = aud_func(self)
+        reusable = service_endpoint in REUSABLE_SERVICE_AUTH_ENDPOINTS
+
+        if reusable:
+            token, token_exp = self._service_auth_cache.get((lxm, aud), (None, 0))
+            if token and token_exp - time() > SERVICE_AUTH_MIN_REMAINING_SECONDS:
+                return token
+
         endpoint = "xrpc/com.atproto.server.getServiceAuth"
         response = self.get(
             hostname=HOSTNAME_ENTRYWAY, endpoint=endpoint, lxm=lxm, aud=aud, exp=exp
         )
+
+        token_exp = get_jwt_expiration(response.token)
+        if reusable and token_exp:
+            self._service_auth_cache[(lxm, aud)] = (response.token, token_exp)
+
         return response.token
 
     def get_upload_limits(self):
@@ -551,7 +754,6 @@ class BskyClientTestMode(BskyClient):
 
     def __init__(self, *args, **kwargs):
         kwargs["ignore_cached_session"] = True
-        self.override_budgets = {}
         self.database = BskySession._meta.database
         create_non_existing_tables(self.database)
         super().__init__(*args, **kwargs)
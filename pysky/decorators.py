@@ -1,4 +1,5 @@
 import inspect
+import threading
 from itertools import count
 
 from pysky.models import APICallLog
@@ -9,6 +10,10 @@ INITIAL_CURSOR_MAP = {
     "xrpc/chat.bsky.convo.getLog": ZERO_CURSOR,
 }
 
+# cursor_context.active is set while a process_cursor decorated method is running,
+# which tells BskyClient.call to log the cursors of the calls it makes
+cursor_context = threading.local()
+
 
 def process_cursor(func, **kwargs):
     """Decorator for any api call that returns a cursor, this looks up the previous
@@ -30,6 +35,7 @@ def process_cursor(func, **kwargs):
         endpoint = kwargs.get("endpoint", _endpoint)
         collection_attr = kwargs.get("collection_attr", _collection_attr)
         paginate = kwargs.get("paginate", _paginate)
+        refresh_cursor = kwargs.pop("refresh_cursor", False)
 
         # only provide the database-backed cursor if one was not passed manually
         if not "cursor" in kwargs:
@@ -45,23 +51,33 @@ def process_cursor(func, **kwargs):
                 kwargs["cursor_key"] = cursor_key
                 where_expressions += [APICallLog.cursor_key == cursor_key]
 
-            previous_db_cursor = (
-                APICallLog.select()
-                .where(*where_expressions)
-                .order_by(APICallLog.timestamp.desc())
-                .first()
-            )
+            # the client keeps this up to date as cursors are received, so the
+            # database only needs to be queried the first time for each key
+            cache_key = (endpoint, cursor_key)
+            if refresh_cursor or cache_key not in self._cursor_cache:
+                previous_db_cursor = (
+                    APICallLog.select()
+                    .where(*where_expressions)
+                    .order_by(APICallLog.timestamp.desc())
+                    .first()
+                )
+                self._cursor_cache[cache_key] = (
+                    previous_db_cursor.cursor_received if previous_db_cursor else None
+                )
 
             initial_cursor = INITIAL_CURSOR_MAP.get(endpoint)
-            kwargs["cursor"] = (
-                previous_db_cursor.cursor_received if previous_db_cursor else initial_cursor
-            )
+            kwargs["cursor"] = self._cursor_cache[cache_key] or initial_cursor
 
-        if paginate:
-            responses = call_with_pagination(self, func, **kwargs)
-            response = combine_paginated_responses(responses, collection_attr)
-        else:
-            response = func(self, **kwargs)
+        previously_active = getattr(cursor_context, "active", False)
+        cursor_context.active = True
+        try:
+            if paginate:
+                responses = call_with_pagination(self, func, **kwargs)
+                response = combine_paginated_responses(responses, collection_attr)
+            else:
+                response = func(self, **kwargs)
+        finally:
+            cursor_context.active = previously_active
 
         return response
 
@@ -70,12 +86,16 @@ def process_cursor(func, **kwargs):
 
 def combine_paginated_responses(responses, collection_attr="logs"):
 
-    for page_response in responses[1:]:
-        combined_collection = getattr(responses[0], collection_attr) + getattr(
-            page_response, collection_attr
-        )
-        setattr(responses[0], collection_attr, combined_collection)
+    # a single page is returned as-is, whether or not it has the collection attribute
+    if len(responses) == 1:
+        return responses[0]
+
+    # build the combined list in one pass rather than re-concatenating per page
+    combined_collection = []
+    for page_response in responses:
+        combined_collection.extend(getattr(page_response, collection_attr))
 
+    setattr(responses[0], collection_attr, combined_collection)
     return responses[0]
 
 
@@ -95,18 +115,14 @@ def call_with_pagination(client, func, **kwargs):
         response = func(client, **kwargs)
         responses.append(response)
 
-        try:
-            new_cursor = getattr(response, "cursor", kwargs["cursor"])
-            if new_cursor == kwargs["cursor"]:
-                break
-
-            pages_received += 1
-            if pages_received >= page_count:
-                break
+        new_cursor = getattr(response, "cursor", kwargs["cursor"])
+        if new_cursor == kwargs["cursor"]:
+            break
 
-            kwargs["cursor"] = new_cursor
+        pages_received += 1
+        if pages_received >= page_count:
+            break
 
-        except AttributeError:
-            raise
+        kwargs["cursor"] = new_cursor
 
     return responses
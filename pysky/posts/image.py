@@ -32,12 +32,16 @@ class Image:
 
     @property
     def size(self):
+        # avoid reading the file just to find out how big it is
+        if not self.data and self.filename:
+            return os.path.getsize(self.filename)
         return len(self.image_data)
 
     @property
     def image_data(self):
         if not self.data:
-            self.data = open(self.filename, "rb").read()
+            with open(self.filename, "rb") as f:
+                self.data = f.read()
         return self.data
 
     def upload(self, bsky, allow_resize=True):
@@ -52,17 +56,26 @@ class Image:
                 "mimetype must be provided, or else a filename or extension from which the mimetype can be guessed"
             )
 
-        if not self.image_data:
+        if not self.size:
             raise Exception("image data not present in Image.upload")
 
+        resized = False
         if allow_resize:
-            original_size = len(self.image_data)
+            original_size = self.size
             resized, original_dimensions, new_dimensions = self.ensure_resized_image()
 
-        self.upload_response = bsky.upload_blob(self.image_data, self.mimetype)
+        if not self.data and self.filename:
+            # the file didn't need resizing, so it can be streamed from disk as-is
+            self.upload_response = bsky.upload_blob(mimetype=self.mimetype, filename=self.filename)
+        else:
+            self.upload_response = bsky.upload_blob(self.image_data, self.mimetype)
 
         try:
-            self.aspect_ratio = self.get_aspect_ratio()
+            if resized:
+                # the resize already produced the final dimensions
+                self.aspect_ratio = {"width": new_dimensions[0], "height": new_dimensions[1]}
+            else:
+                self.aspect_ratio = self.get_aspect_ratio()
         except Exception as e:
             self.aspect_ratio = None
 
@@ -92,12 +105,15 @@ class Image:
         return image
 
     def get_aspect_ratio(self):
-        ar = PILImage.open(io.BytesIO(self.image_data)).size
+        # PIL only reads the image header to get the size
+        source = self.filename if not self.data and self.filename else io.BytesIO(self.image_data)
+        with PILImage.open(source) as image:
+            ar = image.size
         return {"width": ar[0], "height": ar[1]}
 
     def ensure_resized_image(self):
 
-        if len(self.image_data) > MAX_ALLOWED_IMAGE_SIZE:
+        if self.size > MAX_ALLOWED_IMAGE_SIZE:
             original_dimensions, new_dimensions = self.resize_image()
             return True, original_dimensions, new_dimensions
 
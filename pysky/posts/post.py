@@ -1,8 +1,5 @@
 from datetime import datetime, timezone
 
-import bs4
-import markdown
-
 from pysky.models import BskyPost
 from pysky.posts.utils import uploadable, uploaded
 from pysky.posts.facet import Facet
@@ -133,6 +130,11 @@ class Post:
 
     def convert_markdown_text(self):
 
+        # imported here since only markdown posts need them, and they're the
+        # slowest part of importing pysky
+        import bs4
+        import markdown
+
         soup = bs4.BeautifulSoup(markdown.markdown(self.text), "html.parser")
 
         for match in soup.find_all("code"):
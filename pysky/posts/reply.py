@@ -3,6 +3,9 @@ import re
 from pysky.models import BskyPost, APICallLog
 from pysky.client import BskyClient
 
+AT_URI_PATTERN = re.compile(r"at://([^/]+)/([^/]+)/([a-z0-9]+)")
+BSKY_URL_PATTERN = re.compile(r"https://bsky\.app/profile/([^/]+)/(post)/([a-z0-9]+)")
+
 
 class Reply:
 
@@ -15,8 +18,8 @@ class Reply:
         return "at://{self.original_post_repo}/app.bsky.feed.post/{self.original_post_rkey}"
 
     def as_dict(self):
-        bsky = BskyClient()
-        post = bsky.get_post(rkey=self.original_post_rkey, repo=self.original_post_repo)
+        with BskyClient() as bsky:
+            post = bsky.get_post(rkey=self.original_post_rkey, repo=self.original_post_repo)
         try:
             # if this is a reply it has a post.value.reply attr with the root info
             return {
@@ -32,9 +35,7 @@ class Reply:
 
     @staticmethod
     def from_uri(uri):
-        pattern_1 = "at://([^/]+)/([^/]+)/([a-z0-9]+)"
-        pattern_2 = "https://bsky.app/profile/([^/]+)/(post)/([a-z0-9]+)"
-        m = re.match(pattern_1, uri) or re.match(pattern_2, uri)
+        m = AT_URI_PATTERN.match(uri) or BSKY_URL_PATTERN.match(uri)
         assert m, f"invalid reply_uri: {uri}"
         reply_repo, collection, reply_rkey = m.groups()
         assert collection in [
@@ -46,15 +47,17 @@ class Reply:
     @staticmethod
     def from_client_unique_key(client_unique_key):
         # note - this does not scope to user did
-        parent = (
+        # only the uri is needed, so fetch it as a plain value rather than a model instance
+        parent_uri = (
             BskyPost.select(BskyPost.uri)
             .join(APICallLog)
             .where(
                 BskyPost.client_unique_key == client_unique_key,
             )
             .order_by(APICallLog.id.desc())
-            .first()
+            .limit(1)
+            .scalar()
         )
-        assert parent, "can't create a reply to an invalid parent"
+        assert parent_uri, "can't create a reply to an invalid parent"
         # this approach means BskyPost.cid in the model is no longer necessary
-        return Reply.from_uri(parent.uri)
+        return Reply.from_uri(parent_uri)
@@ -42,17 +42,17 @@ class Video:
                 "mimetype must be provided, or else a filename from which the mimetype can be guessed"
             )
 
-        data = open(self.filename, "rb").read()
-
         params = {"did": bsky.did, "name": self.filename.split("/")[-1]}
 
         try:
-            uploaded_blob = bsky.post(
-                params=params,
-                data=data,
-                endpoint="xrpc/app.bsky.video.uploadVideo",
-                headers={"Content-Type": self.mimetype},
-            )
+            # stream the video from disk rather than reading it all into memory first
+            with open(self.filename, "rb") as data:
+                uploaded_blob = bsky.post(
+                    params=params,
+                    data=data,
+                    endpoint="xrpc/app.bsky.video.uploadVideo",
+                    headers={"Content-Type": self.mimetype},
+                )
         except APIError as e:
             # 409 means: "error":"already_exists", "message":"Video already processed"
             if e.apilog.http_status_code == 409:
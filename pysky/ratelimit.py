@@ -1,7 +1,7 @@
 import sys
 from datetime import datetime, timedelta, timezone
 
-from peewee import fn
+from peewee import fn, Case
 
 from pysky.logging import log
 from pysky.models import APICallLog
@@ -17,38 +17,82 @@ WRITE_OP_POINTS_MAP = {
     "xrpc/com.atproto.repo.deleteRecord": 1,
 }
 
+# longest wait for a rate limit to reset before a request is sent anyway. this covers
+# the 5-minute window of the overall request limit but not the write ops windows.
+MAX_RATE_LIMIT_WAIT_SECONDS = 300
+
 
 class RateLimitExceeded(Exception):
     pass
 
 
+def get_rate_limit_reset(headers):
+    """Return the RateLimit-Reset timestamp from a response's headers if its
+    rate limit has been exhausted, otherwise None."""
+
+    try:
+        remaining = int(headers["RateLimit-Remaining"])
+        reset = int(headers["RateLimit-Reset"])
+    except (KeyError, ValueError):
+        return None
+
+    return reset if remaining <= 0 else None
+
+
 def get_budget_used(did, hours):
 
     assert did
     assert hours in [1, 24]
-    budget_sum_row = (
+    budget_sum = (
         APICallLog.select(fn.sum(APICallLog.write_op_points_consumed))
         .where(APICallLog.timestamp >= datetime.now(timezone.utc) - timedelta(hours=hours))
         .where(APICallLog.request_did == did)
-        .first()
+        .scalar()
     )
 
-    try:
-        return budget_sum_row.sum or 0
-    except AttributeError:
-        return 0
+    return budget_sum or 0
 
 
-def check_write_ops_budget(did, hours, points_to_use, override_budget=None):
+def get_budgets_used(did):
+    """Return the points used in every budget window, summed in a single query."""
 
     assert did
-    assert hours in [1, 24]
-    budget = override_budget or WRITE_OPS_BUDGETS[hours]
+    now = datetime.now(timezone.utc)
+    window_sums = [
+        fn.sum(
+            Case(
+                None,
+                [(APICallLog.timestamp >= now - timedelta(hours=hours), APICallLog.write_op_points_consumed)],
+                0,
+            )
+        )
+        for hours in WRITE_OPS_BUDGETS
+    ]
+    budget_sum_row = (
+        APICallLog.select(*window_sums)
+        .where(APICallLog.timestamp >= now - timedelta(hours=max(WRITE_OPS_BUDGETS)))
+        .where(APICallLog.request_did == did)
+        .tuples()
+        .first()
+    ) or [None] * len(WRITE_OPS_BUDGETS)
 
-    budget_used = get_budget_used(did, hours)
-    budget_used += points_to_use
+    return {hours: used or 0 for hours, used in zip(WRITE_OPS_BUDGETS, budget_sum_row)}
+
+
+def check_budget(hours, budget_used, override_budget=None):
+
+    budget = override_budget or WRITE_OPS_BUDGETS[hours]
 
     if budget_used >= budget:
         raise RateLimitExceeded(
             f"This operation would meet or exceed write operations {hours}-hour budget: {budget_used}/{budget} points used"
         )
+
+
+def check_write_ops_budgets(did, points_to_use, override_budgets=None):
+
+    override_budgets = override_budgets or {}
+    budgets_used = get_budgets_used(did)
+
+    for hours in WRITE_OPS_BUDGETS:
+        check_budget(hours, budgets_used[hours] + points_to_use, override_budgets.get(hours))
@@ -1,5 +1,5 @@
 import os
-import inspect
+import threading
 from datetime import datetime
 
 from pysky.logging import log
@@ -21,6 +21,13 @@ class Session:
     ):
         self.auth_header = {}
         self.ignore_cached_session = ignore_cached_session
+        self.did = None
+        self.pds_service_endpoint = None
+
+        # held while the session is being created or refreshed, and incremented
+        # each time a new auth header is set
+        self.lock = threading.RLock()
+        self.generation = 0
 
         try:
             self.bsky_auth_username = (
@@ -33,32 +40,45 @@ class Session:
             self.bsky_auth_username = ""
             self.bsky_auth_password = ""
 
+    @staticmethod
+    def get_token_error(r):
+        # token errors are always a 400, so don't parse the body of any other response
+        if r.status_code != 400:
+            return {}
+        try:
+            error = r.json()
+        except ValueError:
+            return {}
+        return error if isinstance(error, dict) else {}
+
     @staticmethod
     def is_expired_token_response(r):
         # {"error":"ExpiredToken","message":"Token has expired"}
-        return r.status_code == 400 and r.json()["error"] == "ExpiredToken"
+        return Session.is_expired_token_error(Session.get_token_error(r))
 
     @staticmethod
     def is_revoked_token_response(r):
         # {"error":"ExpiredToken","message":"Token has been revoked"}
+        return Session.is_revoked_token_error(Session.get_token_error(r))
+
+    @staticmethod
+    def is_expired_token_error(token_error):
+        return token_error.get("error") == "ExpiredToken"
+
+    @staticmethod
+    def is_revoked_token_error(token_error):
         return (
-            r.status_code == 400
-            and r.json()["error"] == "ExpiredToken"
-            and r.json()["message"] == "Token has been revoked"
+            token_error.get("error") == "ExpiredToken"
+            and token_error.get("message") == "Token has been revoked"
         )
 
     def get_did(self, client):
-        try:
-            return self.did
-        except AttributeError:
+        if not self.did:
             self.load_or_create(client)
-            return self.did
+        return self.did
 
     def get_pds_service_endpoint(self, client):
-        try:
-            return self.pds_service_endpoint
-        except AttributeError:
-            return None
+        return self.pds_service_endpoint
 
     def load_or_create(self, client):
 
@@ -139,6 +159,7 @@ class Session:
 
     def set_auth_header(self):
         self.auth_header = {"Authorization": f"Bearer {self.accessJwt}"}
+        self.generation += 1
         return self.auth_header
 
     def to_dict(self):
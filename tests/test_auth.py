@@ -1,6 +1,17 @@
+import json
+import base64
+from time import time
+from types import SimpleNamespace
+
 from tests.fixtures import bsky
 
 
+def make_jwt(payload):
+    # unsigned, only the payload is read by the client
+    encoded = base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b"=").decode()
+    return f"eyJhbGciOiJFUzI1NksifQ.{encoded}.c2ln"
+
+
 def test_authenticated_success(bsky):
 
     prefs = bsky.get(endpoint="xrpc/app.bsky.actor.getPreferences", hostname="bsky.social")
@@ -12,3 +23,51 @@ def test_authenticated_success(bsky):
         for p in prefs
         if "#interestsPref" in getattr(p, "$type", "")
     )
+
+
+def test_get_jwt_expiration():
+
+    from pysky.client import get_jwt_expiration
+
+    assert get_jwt_expiration(make_jwt({"exp": 1700000000, "lxm": "x"})) == 1700000000
+
+    assert get_jwt_expiration(make_jwt({"lxm": "x"})) is None
+    assert get_jwt_expiration(make_jwt(["exp"])) is None
+    assert get_jwt_expiration("not a jwt") is None
+    assert get_jwt_expiration("a.!!!.c") is None
+    assert get_jwt_expiration("a.bm90IGpzb24.c") is None
+
+
+def test_service_auth_reuse(bsky, monkeypatch):
+
+    from pysky.client import SERVICE_AUTH_MIN_REMAINING_SECONDS
+
+    fetched = []
+
+    def get_service_auth_token(**kwargs):
+        token = make_jwt({"exp": int(time()) + 3600, "n": len(fetched)})
+        fetched.append(token)
+        return SimpleNamespace(token=token)
+
+    monkeypatch.setattr(bsky, "get", get_service_auth_token)
+    monkeypatch.setattr(bsky, "_service_auth_cache", {})
+    endpoint = "xrpc/app.bsky.video.getUploadLimits"
+
+    # a cached token is reused while it has time left
+    token = bsky.get_service_auth(endpoint)
+    assert bsky.get_service_auth(endpoint) == token
+    assert fetched == [token]
+
+    # one that's about to expire is fetched again
+    (cache_key,) = bsky._service_auth_cache
+    bsky._service_auth_cache[cache_key] = (token, time() + SERVICE_AUTH_MIN_REMAINING_SECONDS - 1)
+    new_token = bsky.get_service_auth(endpoint)
+    assert new_token != token
+    assert fetched == [token, new_token]
+    assert bsky.get_service_auth(endpoint) == new_token
+
+    # a token without a readable exp isn't cached
+    monkeypatch.setattr(bsky, "_service_auth_cache", {})
+    monkeypatch.setattr(bsky, "get", lambda **kwargs: SimpleNamespace(token="not a jwt"))
+    assert bsky.get_service_auth(endpoint) == "not a jwt"
+    assert bsky._service_auth_cache == {}
@@ -52,3 +52,62 @@ def test_cursor(bsky):
     blocks = bsky.list_blocks()
     assert len(follows.records) == 0
     assert len(blocks.records) == 0
+
+
+def test_cursor_cache(bsky):
+
+    from uuid import uuid4
+    from pysky.models import APICallLog
+    from pysky.decorators import process_cursor
+
+    endpoint = "xrpc/test.cursorCache"
+    # unique key so that rows from earlier runs against the same database don't match
+    cursor_key = uuid4().hex
+
+    @process_cursor
+    def get_cursor_passed(
+        self,
+        endpoint=endpoint,
+        cursor=None,
+        collection_attr="records",
+        paginate=False,
+        cursor_key_func=lambda kwargs: cursor_key,
+        **kwargs,
+    ):
+        return cursor
+
+    def save_cursor(cursor):
+        APICallLog.create(
+            hostname="bsky.social",
+            endpoint=endpoint,
+            cursor_key=cursor_key,
+            cursor_received=cursor,
+            write_op_points_consumed=0,
+        )
+
+    def delete_cursors():
+        APICallLog.delete().where(APICallLog.cursor_key == cursor_key).execute()
+
+    # the first call reads the cursor from the table
+    save_cursor("cursor-1")
+    assert get_cursor_passed(bsky) == "cursor-1"
+
+    # later calls reuse the cursor kept in memory rather than querying the table again
+    save_cursor("cursor-2")
+    assert get_cursor_passed(bsky) == "cursor-1"
+
+    delete_cursors()
+    assert get_cursor_passed(bsky) == "cursor-1"
+
+    # refresh_cursor=True sees the edited table
+    assert get_cursor_passed(bsky, refresh_cursor=True) is None
+
+    save_cursor("cursor-3")
+    assert get_cursor_passed(bsky) is None
+    assert get_cursor_passed(bsky, refresh_cursor=True) == "cursor-3"
+    assert get_cursor_passed(bsky) == "cursor-3"
+
+    # a manually passed cursor bypasses cursor management entirely
+    assert get_cursor_passed(bsky, cursor="manual") == "manual"
+
+    delete_cursors()
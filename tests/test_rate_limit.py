@@ -1,4 +1,5 @@
-from datetime import datetime, timezone
+from uuid import uuid4
+from datetime import datetime, timedelta, timezone
 
 import pytest
 
@@ -30,3 +31,102 @@ def test_rate_limit(bsky):
         response = bsky.post(
             hostname="bsky.social", endpoint="xrpc/com.atproto.repo.createRecord", params=params
         )
+
+
+def test_write_ops_budgets_used(bsky):
+
+    import pysky
+    from pysky.models import APICallLog
+    from pysky.ratelimit import get_budget_used, get_budgets_used, check_write_ops_budgets
+
+    # unique dids so that rows from earlier runs against the same database don't count
+    run_id = uuid4().hex
+    did = f"did:plc:budget{run_id}"
+    now = datetime.now(timezone.utc)
+
+    # (age, points) - only rows inside each window should count toward it
+    for age, points in [
+        (timedelta(minutes=10), 3),
+        (timedelta(minutes=30), 1),
+        (timedelta(hours=2), 5),
+        (timedelta(hours=23), 7),
+        (timedelta(hours=25), 100),
+    ]:
+        APICallLog.create(
+            timestamp=now - age,
+            hostname="bsky.social",
+            endpoint="xrpc/com.atproto.repo.createRecord",
+            request_did=did,
+            write_op_points_consumed=points,
+        )
+
+    # another account's writes don't count
+    APICallLog.create(
+        timestamp=now,
+        hostname="bsky.social",
+        endpoint="xrpc/com.atproto.repo.createRecord",
+        request_did=f"did:plc:budgetother{run_id}",
+        write_op_points_consumed=50,
+    )
+
+    assert get_budgets_used(did) == {1: 4, 24: 16}
+    assert get_budget_used(did, 1) == 4
+    assert get_budget_used(did, 24) == 16
+    assert get_budgets_used(f"did:plc:budgetnone{run_id}") == {1: 0, 24: 0}
+
+    check_write_ops_budgets(did, points_to_use=3)
+    check_write_ops_budgets(did, points_to_use=3, override_budgets={1: 8, 24: 20})
+
+    with pytest.raises(pysky.RateLimitExceeded, match="1-hour budget: 8/8"):
+        check_write_ops_budgets(did, points_to_use=4, override_budgets={1: 8})
+
+    with pytest.raises(pysky.RateLimitExceeded, match="24-hour budget: 19/19"):
+        check_write_ops_budgets(did, points_to_use=3, override_budgets={24: 19})
+
+
+def test_get_rate_limit_reset():
+
+    from pysky.ratelimit import get_rate_limit_reset
+
+    # only an exhausted limit returns its reset time
+    assert get_rate_limit_reset({"RateLimit-Remaining": "10", "RateLimit-Reset": "1700000000"}) is None
+    assert get_rate_limit_reset({"RateLimit-Remaining": "0", "RateLimit-Reset": "1700000000"}) == 1700000000
+    assert get_rate_limit_reset({"RateLimit-Remaining": "-1", "RateLimit-Reset": "1700000000"}) == 1700000000
+
+    # missing or malformed headers are ignored
+    assert get_rate_limit_reset({}) is None
+    assert get_rate_limit_reset({"RateLimit-Remaining": "0"}) is None
+    assert get_rate_limit_reset({"RateLimit-Remaining": "none", "RateLimit-Reset": "1700000000"}) is None
+    assert get_rate_limit_reset({"RateLimit-Remaining": "0", "RateLimit-Reset": "soon"}) is None
+    assert get_rate_limit_reset({"RateLimit-Remaining": "0", "RateLimit-Reset": "1.5"}) is None
+
+
+def test_wait_for_rate_limit_reset(bsky, monkeypatch):
+
+    from time import time
+    import pysky.client
+    from pysky.ratelimit import MAX_RATE_LIMIT_WAIT_SECONDS
+
+    sleeps = []
+    monkeypatch.setattr(pysky.client, "sleep", sleeps.append)
+
+    hostname = f"ratelimit{uuid4().hex}.test"
+
+    # nothing recorded for the host
+    bsky.wait_for_rate_limit_reset(hostname)
+    assert sleeps == []
+
+    # a reset inside the cap is waited for, once
+    bsky._rate_limit_resets[hostname] = int(time()) + 60
+    bsky.wait_for_rate_limit_reset(hostname)
+    assert len(sleeps) == 1 and 0 < sleeps[0] <= 60
+    bsky.wait_for_rate_limit_reset(hostname)
+    assert len(sleeps) == 1
+
+    # a reset beyond the cap, or one that has already passed, isn't waited for
+    bsky._rate_limit_resets[hostname] = int(time()) + MAX_RATE_LIMIT_WAIT_SECONDS + 60
+    bsky.wait_for_rate_limit_reset(hostname)
+    bsky._rate_limit_resets[hostname] = int(time()) - 60
+    bsky.wait_for_rate_limit_reset(hostname)
+    assert len(sleeps) == 1
+    assert hostname not in bsky._rate_limit_resets
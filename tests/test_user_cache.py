@@ -20,3 +20,60 @@ def test_user_profile_cached_lookup(bsky_no_auth):
     bsky_no_auth.get_user_profile(actor=profile.did, force_remote_call=True)
     remote_call_count = get_remote_call_count(endpoint=endpoint)
     assert remote_call_count == original_remote_call_count + 2
+
+
+def test_user_profile_memory_cache(bsky_no_auth):
+
+    from uuid import uuid4
+    from pysky.models import BskyUserProfile
+
+    # unique so that rows from earlier runs against the same database don't match
+    run_id = uuid4().hex
+    did = f"did:plc:cache{run_id}"
+    handle = f"cache{run_id}.test"
+    BskyUserProfile.create(did=did, handle=handle)
+
+    profile = bsky_no_auth.get_user_profile(actor=did)
+
+    # with the row gone from the table, the lookup by handle has to come from memory
+    BskyUserProfile.delete().where(BskyUserProfile.did == did).execute()
+    assert bsky_no_auth.get_user_profile(actor=handle) is profile
+    assert bsky_no_auth.get_user_profile(actor=f"@{handle}") is profile
+
+    # a newer copy of the profile with a changed handle replaces the old handle key
+    renamed = BskyUserProfile(did=did, handle=f"renamed{run_id}.test")
+    bsky_no_auth.cache_user_profile(renamed)
+    assert handle not in bsky_no_auth._profile_cache
+    assert bsky_no_auth.get_user_profile(actor=did) is renamed
+    assert bsky_no_auth.get_user_profile(actor=renamed.handle) is renamed
+
+
+def test_user_profile_memory_cache_flush_and_ttl(bsky_no_auth, monkeypatch):
+
+    from uuid import uuid4
+    import pysky.client
+    from pysky.models import BskyUserProfile
+
+    run_id = uuid4().hex
+    did = f"did:plc:cachettl{run_id}"
+    BskyUserProfile.create(did=did, handle=f"cachettl{run_id}.test", displayName="one")
+
+    def set_display_name(display_name):
+        BskyUserProfile.update(displayName=display_name).where(
+            BskyUserProfile.did == did
+        ).execute()
+
+    assert bsky_no_auth.get_user_profile(actor=did).displayName == "one"
+
+    # the cached copy is returned until the cache is flushed
+    set_display_name("two")
+    assert bsky_no_auth.get_user_profile(actor=did).displayName == "one"
+
+    bsky_no_auth.flush_profile_cache()
+    assert len(bsky_no_auth._profile_cache) == 0
+    assert bsky_no_auth.get_user_profile(actor=did).displayName == "two"
+
+    # an entry older than the ttl is read from the table again
+    set_display_name("three")
+    monkeypatch.setattr(pysky.client, "PROFILE_CACHE_TTL_SECONDS", 0)
+    assert bsky_no_auth.get_user_profile(actor=did).displayName == "three"